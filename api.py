@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
@@ -9,6 +9,8 @@ import os
 from dotenv import load_dotenv
 from openai import OpenAI
 from individual_functions import Content_grader, Content_writer, Content_changes_proposer, Content_refiner
+from token_budget import TokenBudget, TokenBudgetExceeded, CompletionTruncated, count_tokens, DEFAULT_JOB_TOKEN_BUDGET
+from run_history import get_history
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -27,9 +29,10 @@ app.add_middleware(
 
 class ArticleRequest(BaseModel):
     topic: str = Field(..., description="Article topic")
-    max_tokens: Optional[int] = Field(1500, description="Maximum tokens for article")
+    max_tokens: Optional[int] = Field(1500, ge=1, description="Maximum tokens for article")
     threshold: Optional[float] = Field(9.0, description="Quality threshold score")
     max_refinements: Optional[int] = Field(3, description="Maximum refinement attempts")
+    token_budget: Optional[int] = Field(DEFAULT_JOB_TOKEN_BUDGET, ge=1, description="Total token budget for the whole job")
 
 class StatusUpdate(BaseModel):
     status: str
@@ -39,6 +42,9 @@ class StatusUpdate(BaseModel):
 async def generate_article_stream(request: ArticleRequest):
     """Generate article with real-time status updates via Server-Sent Events"""
     
+    run = None
+    budget = None
+    attempt = 0
     try:
         # Send initial status
         yield f"data: {json.dumps({'status': 'started', 'message': 'Starting article generation...', 'data': None})}\n\n"
@@ -47,20 +53,27 @@ async def generate_article_stream(request: ArticleRequest):
         MAX_REFINEMENTS = request.max_refinements
         THRESHOLD = request.threshold
         query = request.topic
+        MAX_TOKENS = request.max_tokens
+        budget = TokenBudget(request.token_budget)
+        run = get_history().start_run(query, threshold=THRESHOLD, max_refinements=MAX_REFINEMENTS)
+
+        best_article = None
+        best_score = 0.0
+        best_justification = ""
+        best_weaknesses = ""
+        attempt = 0
         
         # Step 1: Generate initial article
         yield f"data: {json.dumps({'status': 'writing', 'message': 'Agent 1: Writing initial article...', 'data': {'attempt': 0}})}\n\n"
         await asyncio.sleep(0.1)
         
-        article = await Content_writer(query=query)
+        article = await Content_writer(query=query, budget=budget, max_tokens=MAX_TOKENS)
+        run.event('written', attempt=0, article=article)
         
         yield f"data: {json.dumps({'status': 'written', 'message': 'Agent 1: Initial article completed!', 'data': {'article_length': len(article), 'attempt': 0}})}\n\n"
         await asyncio.sleep(0.1)
         
         best_article = article
-        best_score = 0.0
-        best_justification = ""
-        best_weaknesses = ""
         
         # Refinement loop - will run MAX_REFINEMENTS times or until threshold is met
         for attempt in range(1, MAX_REFINEMENTS + 1):
@@ -69,8 +82,10 @@ async def generate_article_stream(request: ArticleRequest):
             await asyncio.sleep(0.1)
             
             score, justification, weaknesses = await Content_grader(
-                article_content=article
+                article_content=article,
+                budget=budget
             )
+            run.event('graded', attempt=attempt, score=score, data={'justification': justification, 'weaknesses': weaknesses})
             
             yield f"data: {json.dumps({'status': 'graded', 'message': f'Agent 2: Score is {score}/10', 'data': {'score': score, 'attempt': attempt, 'threshold': THRESHOLD}})}\n\n"
             await asyncio.sleep(0.1)
@@ -89,7 +104,8 @@ async def generate_article_stream(request: ArticleRequest):
                 yield f"data: {json.dumps({'status': 'success', 'message': f'🎉 Article meets quality threshold! ({score} >= {THRESHOLD})', 'data': {'score': score, 'threshold': THRESHOLD}})}\n\n"
                 await asyncio.sleep(0.1)
                 
-                yield f"data: {json.dumps({'status': 'completed', 'message': f'Final article ready with score {score}/10', 'data': {'final_score': score, 'article': article, 'justification': justification, 'weaknesses': weaknesses, 'attempts': attempt, 'total_refinements': attempt - 1}})}\n\n"
+                run.finish('completed', final_score=score, attempts=attempt, refinements=attempt - 1, article=article, token_usage=budget.report())
+                yield f"data: {json.dumps({'status': 'completed', 'message': f'Final article ready with score {score}/10', 'data': {'final_score': score, 'article': article, 'justification': justification, 'weaknesses': weaknesses, 'attempts': attempt, 'total_refinements': attempt - 1, 'token_usage': budget.report()}})}\n\n"
                 return
             
             # If we've reached max refinements, return best version
@@ -97,9 +113,15 @@ async def generate_article_stream(request: ArticleRequest):
                 yield f"data: {json.dumps({'status': 'max_reached', 'message': f'⚠️ Max refinements ({MAX_REFINEMENTS}) reached. Returning best version.', 'data': {'best_score': best_score}})}\n\n"
                 await asyncio.sleep(0.1)
                 
-                yield f"data: {json.dumps({'status': 'completed', 'message': f'Final article (best of {MAX_REFINEMENTS} attempts) with score {best_score}/10', 'data': {'final_score': best_score, 'article': best_article, 'justification': best_justification, 'weaknesses': best_weaknesses, 'attempts': MAX_REFINEMENTS, 'total_refinements': MAX_REFINEMENTS}})}\n\n"
+                run.finish('max_reached', final_score=best_score, attempts=MAX_REFINEMENTS, refinements=MAX_REFINEMENTS, article=best_article, token_usage=budget.report())
+                yield f"data: {json.dumps({'status': 'completed', 'message': f'Final article (best of {MAX_REFINEMENTS} attempts) with score {best_score}/10', 'data': {'final_score': best_score, 'article': best_article, 'justification': best_justification, 'weaknesses': best_weaknesses, 'attempts': MAX_REFINEMENTS, 'total_refinements': MAX_REFINEMENTS, 'token_usage': budget.report()}})}\n\n"
                 return
             
+            # Stop early if the remaining budget cannot cover another full round
+            projected = budget.estimate_iteration(count_tokens(article, "gpt-4.1"), MAX_TOKENS)
+            if not budget.can_afford(projected):
+                raise TokenBudgetExceeded("refinement", projected, budget.remaining)
+            
             # Score is below threshold and we have more attempts - refine the article
             yield f"data: {json.dumps({'status': 'below_threshold', 'message': f'Score {score} < {THRESHOLD}. Initiating refinement {attempt}/{MAX_REFINEMENTS}...', 'data': {'score': score, 'threshold': THRESHOLD}})}\n\n"
             await asyncio.sleep(0.1)
@@ -113,8 +135,10 @@ async def generate_article_stream(request: ArticleRequest):
                 score=score,
                 justification=justification,
                 weaknesses=weaknesses,
-                Threshold=THRESHOLD
+                Threshold=THRESHOLD,
+                budget=budget
             )
+            run.event('proposed', attempt=attempt, data={'changes': changes})
             
             yield f"data: {json.dumps({'status': 'proposed', 'message': f'Agent 3: Changes proposed successfully', 'data': {'attempt': attempt}})}\n\n"
             await asyncio.sleep(0.1)
@@ -125,8 +149,11 @@ async def generate_article_stream(request: ArticleRequest):
             
             article = await Content_refiner(
                 changes=changes,
-                article_content=article
+                article_content=article,
+                budget=budget,
+                max_tokens=MAX_TOKENS
             )
+            run.event('refined', attempt=attempt, article=article)
             
             yield f"data: {json.dumps({'status': 'refined', 'message': f'Agent 4: Refinement {attempt} complete. Re-evaluating...', 'data': {'attempt': attempt}})}\n\n"
             await asyncio.sleep(0.1)
@@ -135,12 +162,30 @@ async def generate_article_stream(request: ArticleRequest):
         
         # This should never be reached due to the return statements above
         # but included for safety
-        yield f"data: {json.dumps({'status': 'completed', 'message': f'Article generation complete', 'data': {'final_score': best_score, 'article': best_article, 'justification': best_justification, 'weaknesses': best_weaknesses, 'attempts': MAX_REFINEMENTS, 'total_refinements': MAX_REFINEMENTS}})}\n\n"
+        run.finish('completed', final_score=best_score, attempts=MAX_REFINEMENTS, refinements=MAX_REFINEMENTS, article=best_article, token_usage=budget.report())
+        yield f"data: {json.dumps({'status': 'completed', 'message': f'Article generation complete', 'data': {'final_score': best_score, 'article': best_article, 'justification': best_justification, 'weaknesses': best_weaknesses, 'attempts': MAX_REFINEMENTS, 'total_refinements': MAX_REFINEMENTS, 'token_usage': budget.report()}})}\n\n"
+        
+    except (TokenBudgetExceeded, CompletionTruncated) as e:
+        # Degrade gracefully: hand back the best graded version instead of failing
+        status = 'truncated' if isinstance(e, CompletionTruncated) else 'budget_exhausted'
+        run.finish(status, final_score=best_score, attempts=attempt, refinements=max(attempt - 1, 0), article=best_article, token_usage=budget.report())
+        yield f"data: {json.dumps({'status': status, 'message': f'⚠️ {e}. Returning best version.', 'data': {'token_usage': budget.report()}})}\n\n"
+        if best_article is None:
+            yield f"data: {json.dumps({'status': 'error', 'message': f'No article could be generated: {e}', 'data': {'token_usage': budget.report()}})}\n\n"
+            return
+        yield f"data: {json.dumps({'status': 'completed', 'message': f'Final article (token limited) with score {best_score}/10', 'data': {'final_score': best_score, 'article': best_article, 'justification': best_justification, 'weaknesses': best_weaknesses, 'attempts': attempt, 'total_refinements': max(attempt - 1, 0), 'token_usage': budget.report()}})}\n\n"
         
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
+        if run is not None:
+            run.finish('error', attempts=attempt, token_usage=budget.report() if budget else None)
         yield f"data: {json.dumps({'status': 'error', 'message': f'Error: {str(e)}', 'data': {'error_details': error_details}})}\n\n"
+        
+    finally:
+        # Client disconnects close the generator with GeneratorExit / CancelledError
+        if run is not None and not run.finished:
+            run.finish('cancelled', attempts=attempt, token_usage=budget.report())
 
 @app.post("/api/generate-article")
 async def generate_article(request: ArticleRequest):
@@ -155,6 +200,35 @@ async def generate_article(request: ArticleRequest):
         }
     )
 
+@app.get("/api/runs")
+def list_runs(
+    topic: Optional[str] = Query(None, description="Case-insensitive substring of the topic"),
+    min_score: Optional[float] = Query(None, description="Minimum final score"),
+    max_score: Optional[float] = Query(None, description="Maximum final score"),
+    since: Optional[str] = Query(None, description="Runs started on or after this ISO date (UTC)"),
+    until: Optional[str] = Query(None, description="Runs started on or before this ISO date (UTC)"),
+    status: Optional[str] = Query(None, description="Final run status"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """List recorded article runs, newest first"""
+    try:
+        runs = get_history().list_runs(
+            topic=topic, min_score=min_score, max_score=max_score,
+            since=since, until=until, status=status, limit=limit, offset=offset
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid since/until date: {e}")
+    return {"runs": runs, "count": len(runs)}
+
+@app.get("/api/runs/{run_id}")
+def get_run(run_id: str, include_articles: bool = False):
+    """Fetch one run with its stage events and timings"""
+    run = get_history().get_run(run_id, include_articles=include_articles)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
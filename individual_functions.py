@@ -5,10 +5,12 @@ import asyncio
 from pydantic import BaseModel, Field
 from workflows import Context, Workflow, step
 from workflows.events import Event, StartEvent, StopEvent
-from openai import OpenAI
+from openai import OpenAI, LengthFinishReasonError
 import os
 from dotenv import load_dotenv
-from prompts import Article_Generator_Prompt, Article_scorer_Prompt , Article_changes_proposer_prompt, Refined_Article_Prompt,model
+from prompts import Article_Generator_Prompt, Article_scorer_Prompt , Article_changes_proposer_prompt, Refined_Article_Prompt,model, with_length_limit
+from token_budget import TokenBudget, CompletionTruncated, count_message_tokens, completion_estimate, trim_text, FEEDBACK_TOKEN_LIMIT
+from typing import Optional
 import uuid
 # from llama_index.core.llms import ChatMessage
 # from llama_index.core.memory import ChatMemoryBuffer
@@ -32,23 +34,66 @@ class Agent3(BaseModel):
     output : str
 
 
+def _parse_with_budget(stage:str, model_name:str, messages:list, response_format, budget:Optional[TokenBudget] = None, max_tokens:Optional[int] = None):
+    """
+    Count the prompt locally, check it against the job budget and record actual usage.
+    """
+    prompt_tokens = count_message_tokens(messages, model_name)
+    projected = prompt_tokens + completion_estimate(model_name, max_tokens)
+    if budget is not None:
+        budget.reserve(stage, projected)
+
+    kwargs = {}
+    if max_tokens:
+        kwargs["max_completion_tokens"] = max_tokens
+
+    try:
+        completion = client.chat.completions.parse(
+                model=model_name,
+                messages=messages,
+                response_format=response_format,
+                **kwargs,
+            )
+    except LengthFinishReasonError as e:
+        # The truncated call is still billed, so record it before degrading
+        _record_usage(budget, stage, projected, prompt_tokens, e.completion)
+        raise CompletionTruncated(stage, max_tokens) from e
+
+    _record_usage(budget, stage, projected, prompt_tokens, completion)
+
+    return completion
+
+
+def _record_usage(budget:Optional[TokenBudget], stage:str, projected:int, prompt_tokens:int, completion):
+    if budget is None:
+        return
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        budget.record(stage, projected, usage.prompt_tokens, usage.completion_tokens)
+    else:
+        budget.record(stage, projected, prompt_tokens, 0)
+
+
 
 
 # tone, word_count, should be added for more flexibility
-async def Content_writer(query:str):
+async def Content_writer(query:str, budget:Optional[TokenBudget] = None, max_tokens:Optional[int] = None):
     """
     function for article content generation
     """
     print("Entered Content Generator Function")
     print("Writing the Article .......")
-    completion = client.chat.completions.parse(
-            model="gpt-4.1",
-            messages=[
+    completion = _parse_with_budget(
+            "writer",
+            "gpt-4.1",
+            [
                 # *to_openai_messages(read_memory()),
-                {"role": "system", "content": Article_Generator_Prompt},
+                {"role": "system", "content": with_length_limit(Article_Generator_Prompt, max_tokens)},
                 {"role": "user", "content": query},
             ],
-            response_format=Agent1,
+            Agent1,
+            budget=budget,
+            max_tokens=max_tokens,
         )
 
     answer = completion.choices[0].message.parsed.output
@@ -60,20 +105,22 @@ async def Content_writer(query:str):
     return answer
 
 
-async def Content_grader(article_content:str):
+async def Content_grader(article_content:str, budget:Optional[TokenBudget] = None):
     """
     function for scoring article content.
     """
     print("Entered Content Grader Function")
     print("Grading the Article ......")
-    completion = client.chat.completions.parse(
-            model=model,
-            messages=[
+    completion = _parse_with_budget(
+            "grader",
+            model,
+            [
                 # *to_openai_messages(read_memory()),
                 {"role": "system", "content": Article_scorer_Prompt},
                 {"role": "user", "content": article_content},
             ],
-            response_format=Agent2,
+            Agent2,
+            budget=budget,
         )
 
     answer = completion.choices[0].message.parsed
@@ -88,21 +135,27 @@ async def Content_grader(article_content:str):
 
 
 
-async def Content_changes_proposer(article_content:str , score :int , justification: str , weaknesses : str , Threshold:int):
+async def Content_changes_proposer(article_content:str , score :int , justification: str , weaknesses : str , Threshold:int, budget:Optional[TokenBudget] = None):
     """
     function for scoring article content.
     """
     print(f"Oh......! , it seems to be article acheived a score less than {Threshold} , No worries , getting that fixed ")
     print("Proposing Changes .........")
-    
-    completion = client.chat.completions.parse(
-            model=model,
-            messages=[
+
+    # Keep grader feedback from crowding out the article itself
+    justification = trim_text(justification, FEEDBACK_TOKEN_LIMIT, model)
+    weaknesses = trim_text(weaknesses, FEEDBACK_TOKEN_LIMIT, model)
+
+    completion = _parse_with_budget(
+            "proposer",
+            model,
+            [
                 # *to_openai_messages(read_memory()),
                 {"role": "system", "content": Article_changes_proposer_prompt},
                 {"role": "user", "content": article_content + f"Score : {score}" + "Justifications : " + justification + "weaknesses:" + weaknesses},
             ],
-            response_format=Agent3,
+            Agent3,
+            budget=budget,
         )
 
     answer = completion.choices[0].message.parsed.output
@@ -116,21 +169,24 @@ async def Content_changes_proposer(article_content:str , score :int , justificat
 
 
 
-async def Content_refiner(article_content:str ,changes:str):
+async def Content_refiner(article_content:str ,changes:str, budget:Optional[TokenBudget] = None, max_tokens:Optional[int] = None):
     """
     function for scoring article content.
     """
     print("Refining the Article in Best possible way ......")
     print("Almost Done !")
-    
-    completion = client.chat.completions.parse(
-            model="gpt-4.1",
-            messages=[
+
+    completion = _parse_with_budget(
+            "refiner",
+            "gpt-4.1",
+            [
                 # *to_openai_messages(read_memory()),
-                {"role": "system", "content": Refined_Article_Prompt},
+                {"role": "system", "content": with_length_limit(Refined_Article_Prompt, max_tokens)},
                 {"role": "user", "content": article_content + "changes_proposed :" + changes},
             ],
-            response_format=Agent1,
+            Agent1,
+            budget=budget,
+            max_tokens=max_tokens,
         )
 
     answer = completion.choices[0].message.parsed.output
@@ -97,6 +97,8 @@ from workflows import Workflow, step, Context
 from workflows.events import StartEvent, StopEvent
 from openai import OpenAI
 from individual_functions import Content_grader, Content_writer, Content_changes_proposer, Content_refiner
+from token_budget import TokenBudget, TokenBudgetExceeded, CompletionTruncated, count_tokens, DEFAULT_JOB_TOKEN_BUDGET
+from run_history import get_history
 
 # -------------------------
 # Load environment variables
@@ -119,6 +121,9 @@ class MainWorkflow(Workflow):
 
         MAX_REFINEMENTS = 3
         THRESHOLD = 9.0
+        MAX_TOKENS = 1500
+        budget = TokenBudget(DEFAULT_JOB_TOKEN_BUDGET)
+        run = get_history().start_run(query, threshold=THRESHOLD, max_refinements=MAX_REFINEMENTS)
 
         print(f"\n{'='*80}")
         print(f"STARTING ARTICLE GENERATION WORKFLOW")
@@ -126,110 +131,173 @@ class MainWorkflow(Workflow):
         print(f"Topic: {query}")
         print(f"Threshold: {THRESHOLD}/10")
         print(f"Max Refinements: {MAX_REFINEMENTS}")
+        print(f"Token Budget: {budget.total}")
         print(f"{'='*80}\n")
 
-        # Step 1: Generate initial article (ONCE, outside loop)
-        print(f"[AGENT 1] Generating initial article...")
-        article = await Content_writer(query=query)
-        print(f"[AGENT 1] ✓ Initial article created ({len(article)} characters)\n")
-
-        best_article = article
+        best_article = None
         best_score = 0.0
         best_justification = ""
         best_weaknesses = ""
+        attempt = 0
 
-        # Refinement loop - runs from 1 to MAX_REFINEMENTS
-        for attempt in range(1, MAX_REFINEMENTS + 1):
-            print(f"{'='*80}")
-            print(f"ITERATION {attempt}/{MAX_REFINEMENTS}")
-            print(f"{'='*80}")
-            
-            # Step 2: Grade the current article
-            print(f"[AGENT 2] Grading article (Attempt {attempt})...")
-            score, justification, weaknesses = await Content_grader(
-                article_content=article
-            )
-            print(f"[AGENT 2] Score: {score}/10")
-            print(f"[AGENT 2] Justification: {justification[:150]}...")
-            
-            # Track best version seen so far
-            if score > best_score:
-                best_score = score
-                best_article = article
-                best_justification = justification
-                best_weaknesses = weaknesses
-                print(f"[INFO] ✓ New best score recorded: {best_score}/10")
-
-            # Check if quality threshold is met
-            if score >= THRESHOLD:
-                print(f"\n{'='*80}")
-                print(f"SUCCESS! Article meets quality threshold")
+        try:
+            # Step 1: Generate initial article (ONCE, outside loop)
+            print(f"[AGENT 1] Generating initial article...")
+            article = await Content_writer(query=query, budget=budget, max_tokens=MAX_TOKENS)
+            run.event('written', attempt=0, article=article)
+            print(f"[AGENT 1] ✓ Initial article created ({len(article)} characters)\n")
+
+            best_article = article
+
+            # Refinement loop - runs from 1 to MAX_REFINEMENTS
+            for attempt in range(1, MAX_REFINEMENTS + 1):
                 print(f"{'='*80}")
-                print(f"Final Score: {score}/10")
-                print(f"Threshold: {THRESHOLD}/10")
-                print(f"Total Refinements: {attempt - 1}")
-                print(f"{'='*80}\n")
-                return StopEvent(result={
-                    'article': article,
-                    'score': score,
-                    'justification': justification,
-                    'weaknesses': weaknesses,
-                    'attempts': attempt,
-                    'refinements': attempt - 1
-                })
-
-            # Check if we've reached max attempts
-            if attempt >= MAX_REFINEMENTS:
-                print(f"\n{'='*80}")
-                print(f"MAX REFINEMENTS REACHED")
+                print(f"ITERATION {attempt}/{MAX_REFINEMENTS}")
                 print(f"{'='*80}")
-                print(f"Returning best version from all attempts")
-                print(f"Best Score: {best_score}/10")
-                print(f"Total Refinements: {MAX_REFINEMENTS}")
-                print(f"{'='*80}\n")
-                return StopEvent(result={
-                    'article': best_article,
-                    'score': best_score,
-                    'justification': best_justification,
-                    'weaknesses': best_weaknesses,
-                    'attempts': MAX_REFINEMENTS,
-                    'refinements': MAX_REFINEMENTS
-                })
-
-            # Score is below threshold and we have more attempts - refine
-            print(f"[INFO] Score {score} < {THRESHOLD}. Refinement needed.")
-            print(f"[INFO] Remaining attempts: {MAX_REFINEMENTS - attempt}\n")
-
-            # Step 3: Propose changes
-            print(f"[AGENT 3] Analyzing article and proposing improvements...")
-            changes = await Content_changes_proposer(
-                article_content=article,
-                score=score,
-                justification=justification,
-                weaknesses=weaknesses,
-                Threshold=THRESHOLD
-            )
-            print(f"[AGENT 3] ✓ Changes proposed\n")
-
-            # Step 4: Refine article
-            print(f"[AGENT 4] Applying proposed changes to article...")
-            article = await Content_refiner(
-                changes=changes,
-                article_content=article
-            )
-            print(f"[AGENT 4] ✓ Article refined ({len(article)} characters)")
-            print(f"[INFO] Proceeding to next evaluation...\n")
-
-        # This should never be reached due to the return statements above
-        # but included as a safety fallback
-        return StopEvent(result={
-            'article': best_article,
-            'score': best_score,
-            'justification': best_justification,
-            'weaknesses': best_weaknesses,
-            'attempts': MAX_REFINEMENTS,
-            'refinements': MAX_REFINEMENTS
-        })
+            
+                # Step 2: Grade the current article
+                print(f"[AGENT 2] Grading article (Attempt {attempt})...")
+                score, justification, weaknesses = await Content_grader(
+                    article_content=article,
+                    budget=budget
+                )
+                run.event('graded', attempt=attempt, score=score, data={'justification': justification, 'weaknesses': weaknesses})
+                print(f"[AGENT 2] Score: {score}/10")
+                print(f"[AGENT 2] Justification: {justification[:150]}...")
+            
+                # Track best version seen so far
+                if score > best_score:
+                    best_score = score
+                    best_article = article
+                    best_justification = justification
+                    best_weaknesses = weaknesses
+                    print(f"[INFO] ✓ New best score recorded: {best_score}/10")
+
+                # Check if quality threshold is met
+                if score >= THRESHOLD:
+                    print(f"\n{'='*80}")
+                    print(f"SUCCESS! Article meets quality threshold")
+                    print(f"{'='*80}")
+                    print(f"Final Score: {score}/10")
+                    print(f"Threshold: {THRESHOLD}/10")
+                    print(f"Total Refinements: {attempt - 1}")
+                    print(f"{'='*80}\n")
+                    run.finish('completed', final_score=score, attempts=attempt, refinements=attempt - 1, article=article, token_usage=budget.report())
+                    return StopEvent(result={
+                        'article': article,
+                        'score': score,
+                        'justification': justification,
+                        'weaknesses': weaknesses,
+                        'attempts': attempt,
+                        'refinements': attempt - 1,
+                        'token_usage': budget.report()
+                    })
+
+                # Check if we've reached max attempts
+                if attempt >= MAX_REFINEMENTS:
+                    print(f"\n{'='*80}")
+                    print(f"MAX REFINEMENTS REACHED")
+                    print(f"{'='*80}")
+                    print(f"Returning best version from all attempts")
+                    print(f"Best Score: {best_score}/10")
+                    print(f"Total Refinements: {MAX_REFINEMENTS}")
+                    print(f"{'='*80}\n")
+                    run.finish('max_reached', final_score=best_score, attempts=MAX_REFINEMENTS, refinements=MAX_REFINEMENTS, article=best_article, token_usage=budget.report())
+                    return StopEvent(result={
+                        'article': best_article,
+                        'score': best_score,
+                        'justification': best_justification,
+                        'weaknesses': best_weaknesses,
+                        'attempts': MAX_REFINEMENTS,
+                        'refinements': MAX_REFINEMENTS,
+                        'token_usage': budget.report()
+                    })
+
+                # Stop early if the remaining budget cannot cover another full round
+                projected = budget.estimate_iteration(count_tokens(article, "gpt-4.1"), MAX_TOKENS)
+                if not budget.can_afford(projected):
+                    print(f"\n[INFO] Token budget exhausted (needs ~{projected}, {budget.remaining} remaining)")
+                    print(f"[INFO] Returning best version so far\n")
+                    run.finish('budget_exhausted', final_score=best_score, attempts=attempt, refinements=attempt - 1, article=best_article, token_usage=budget.report())
+                    return StopEvent(result={
+                        'article': best_article,
+                        'score': best_score,
+                        'justification': best_justification,
+                        'weaknesses': best_weaknesses,
+                        'attempts': attempt,
+                        'refinements': attempt - 1,
+                        'token_usage': budget.report()
+                    })
+
+                # Score is below threshold and we have more attempts - refine
+                print(f"[INFO] Score {score} < {THRESHOLD}. Refinement needed.")
+                print(f"[INFO] Remaining attempts: {MAX_REFINEMENTS - attempt}\n")
+
+                # Step 3: Propose changes
+                print(f"[AGENT 3] Analyzing article and proposing improvements...")
+                changes = await Content_changes_proposer(
+                    article_content=article,
+                    score=score,
+                    justification=justification,
+                    weaknesses=weaknesses,
+                    Threshold=THRESHOLD,
+                    budget=budget
+                )
+                run.event('proposed', attempt=attempt, data={'changes': changes})
+                print(f"[AGENT 3] ✓ Changes proposed\n")
+
+                # Step 4: Refine article
+                print(f"[AGENT 4] Applying proposed changes to article...")
+                article = await Content_refiner(
+                    changes=changes,
+                    article_content=article,
+                    budget=budget,
+                    max_tokens=MAX_TOKENS
+                )
+                run.event('refined', attempt=attempt, article=article)
+                print(f"[AGENT 4] ✓ Article refined ({len(article)} characters)")
+                print(f"[INFO] Proceeding to next evaluation...\n")
+
+            # This should never be reached due to the return statements above
+            # but included as a safety fallback
+            run.finish('completed', final_score=best_score, attempts=MAX_REFINEMENTS, refinements=MAX_REFINEMENTS, article=best_article, token_usage=budget.report())
+            return StopEvent(result={
+                'article': best_article,
+                'score': best_score,
+                'justification': best_justification,
+                'weaknesses': best_weaknesses,
+                'attempts': MAX_REFINEMENTS,
+                'refinements': MAX_REFINEMENTS,
+                'token_usage': budget.report()
+            })
+
+        except (TokenBudgetExceeded, CompletionTruncated) as e:
+            # Degrade gracefully: return the best graded version instead of crashing
+            status = 'truncated' if isinstance(e, CompletionTruncated) else 'budget_exhausted'
+            print(f"\n[INFO] {e}")
+            print(f"[INFO] Returning best version so far\n")
+            run.finish(status, final_score=best_score, attempts=attempt, refinements=max(attempt - 1, 0), article=best_article, token_usage=budget.report())
+            if best_article is None:
+                raise
+            return StopEvent(result={
+                'article': best_article,
+                'score': best_score,
+                'justification': best_justification,
+                'weaknesses': best_weaknesses,
+                'attempts': attempt,
+                'refinements': max(attempt - 1, 0),
+                'status': status,
+                'token_usage': budget.report()
+            })
+
+        except asyncio.CancelledError:
+            run.finish('cancelled', attempts=attempt, token_usage=budget.report())
+            raise
+
+        finally:
+            # Any other exception would otherwise leave the run as 'running' forever
+            if not run.finished:
+                run.finish('error', attempts=attempt, token_usage=budget.report())
 
 
 # -------------------------
@@ -254,6 +322,9 @@ async def main():
         print(f"\nFinal Score: {result['score']}/10")
         print(f"Total Attempts: {result['attempts']}")
         print(f"Total Refinements: {result['refinements']}")
+        usage = result.get('token_usage')
+        if usage:
+            print(f"Tokens (projected / actual): {usage['projected']} / {usage['actual']} of {usage['budget']}")
         print(f"\nJustification:\n{result['justification']}")
         if result.get('weaknesses'):
             print(f"\nWeaknesses:\n{result['weaknesses']}")
@@ -97,4 +97,22 @@ Refined_Article_Prompt  = """
     - The final output must be a clean, high-quality article suitable for publication.
 
 
-    """
\ No newline at end of file
+    """
+
+
+
+Length_limit_instruction = """
+    Length limit:
+    - The complete article must stay under {words} words (a hard limit of {max_tokens} tokens).
+    - Plan the sections to fit this length and always finish with a complete conclusion.
+    """
+
+
+def with_length_limit(prompt: str, max_tokens=None) -> str:
+    """
+    Append the article length limit to a writer / refiner system prompt.
+    """
+    if not max_tokens:
+        return prompt
+    # ~0.75 words per token, minus headroom for headings and the JSON wrapper
+    return prompt + Length_limit_instruction.format(words=int(max_tokens * 0.6), max_tokens=max_tokens)
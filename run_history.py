@@ -0,0 +1,428 @@
+import argparse
+import atexit
+import csv
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+
+# -------------------------
+# Defaults
+# -------------------------
+RUN_HISTORY_DB = os.getenv("RUN_HISTORY_DB", "run_history.db")
+BATCH_SIZE = 256          # max queued records written per transaction
+FLUSH_INTERVAL = 0.5      # seconds the writer waits before flushing a partial batch
+CLOSE_TIMEOUT = 5.0       # seconds close() waits for pending writes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    topic TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    threshold REAL,
+    max_refinements INTEGER
+);
+CREATE TABLE IF NOT EXISTS run_results (
+    run_id TEXT PRIMARY KEY,
+    finished_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    final_score REAL,
+    attempts INTEGER,
+    refinements INTEGER,
+    duration_ms REAL,
+    final_article_hash TEXT,
+    token_usage TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    run_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    ts REAL NOT NULL,
+    elapsed_ms REAL NOT NULL,
+    attempt INTEGER,
+    score REAL,
+    article_hash TEXT,
+    data TEXT,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE TABLE IF NOT EXISTS articles (
+    hash TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS idx_runs_topic ON runs (topic);
+"""
+
+# Runs joined with their (appended) result row; unfinished runs report 'running'
+RUN_SELECT = """
+SELECT runs.run_id, runs.topic, runs.started_at, runs.threshold, runs.max_refinements,
+       res.finished_at, COALESCE(res.status, 'running') AS status, res.final_score,
+       res.attempts, res.refinements, res.duration_ms, res.final_article_hash, res.token_usage
+FROM runs LEFT JOIN run_results AS res ON res.run_id = runs.run_id
+"""
+
+
+def _utc_iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def parse_date(value: str, end_of_day: bool = False) -> str:
+    """
+    Normalise an ISO date / datetime to the UTC format stored in started_at.
+    A bare date with end_of_day=True covers the whole day. Raises ValueError on bad input.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_of_day and len(value) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59)
+    return parsed.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _article_hash(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class RunRecorder:
+    """
+    Records the stage events of a single article run.
+    """
+
+    def __init__(self, history: "RunHistory", run_id: str, started: float):
+        self.history = history
+        self.run_id = run_id
+        self.started = started
+        self._last = started
+        self._seq = 0
+        self.finished = False
+
+    def event(self, stage: str, attempt: Optional[int] = None, score: Optional[float] = None,
+              article: Optional[str] = None, data: Optional[dict] = None):
+        """
+        Queue a stage event; elapsed_ms is the time since the previous event of this run.
+        """
+        now = time.time()
+        self._seq += 1
+        self.history._put(("event", self.run_id, self._seq, stage, now,
+                           (now - self._last) * 1000, attempt, score, article, data))
+        self._last = now
+
+    def finish(self, status: str, final_score: Optional[float] = None, attempts: Optional[int] = None,
+               refinements: Optional[int] = None, article: Optional[str] = None,
+               token_usage: Optional[dict] = None):
+        """
+        Append the run result; only the first call per run is recorded.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        now = time.time()
+        self.history._put(("finish", self.run_id, status, now, (now - self.started) * 1000,
+                           final_score, attempts, refinements, article, token_usage))
+
+
+class RunHistory:
+    """
+    Append-only SQLite store of article runs.
+
+    Writes are queued and flushed in batches by a background thread, so recording
+    an event on the request path costs a single queue put.
+    """
+
+    def __init__(self, path: str = RUN_HISTORY_DB):
+        self.path = path
+        self._queue = queue.Queue()
+        self._closed = False
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name="run-history-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # -------------------------
+    # Write path
+    # -------------------------
+    def start_run(self, topic: str, threshold: Optional[float] = None,
+                  max_refinements: Optional[int] = None) -> RunRecorder:
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        self._put(("start", run_id, topic, now, threshold, max_refinements))
+        return RunRecorder(self, run_id, now)
+
+    def _put(self, item: tuple):
+        if not self._closed and self._writer.is_alive():
+            self._queue.put_nowait(item)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until everything queued so far has been written; returns False on timeout.
+        """
+        if not self._writer.is_alive():
+            return False
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout)
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or batch[-1] is None or batch[-1][0] == "flush":
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            try:
+                self._write_batch(conn, batch)
+            except Exception as e:
+                # Never let one bad batch stop the writer thread
+                print(f"[RUN HISTORY] Failed to write {len(batch)} records: {e}", file=sys.stderr)
+            for entry in batch:
+                if entry[0] == "flush":
+                    entry[1].set()
+            if stop:
+                break
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: list):
+        runs, finishes, events, articles = [], [], [], {}
+        for entry in batch:
+            kind = entry[0]
+            if kind == "start":
+                _, run_id, topic, ts, threshold, max_refinements = entry
+                runs.append((run_id, topic, _utc_iso(ts), threshold, max_refinements))
+            elif kind == "event":
+                _, run_id, seq, stage, ts, elapsed_ms, attempt, score, article, data = entry
+                digest = None
+                if article is not None:
+                    digest = _article_hash(article)
+                    articles[digest] = article
+                events.append((run_id, seq, stage, ts, elapsed_ms, attempt, score, digest,
+                               json.dumps(data, default=str) if data is not None else None))
+            elif kind == "finish":
+                _, run_id, status, ts, duration_ms, final_score, attempts, refinements, article, token_usage = entry
+                digest = None
+                if article is not None:
+                    digest = _article_hash(article)
+                    articles[digest] = article
+                finishes.append((run_id, _utc_iso(ts), status, final_score, attempts, refinements, duration_ms, digest,
+                                 json.dumps(token_usage, default=str) if token_usage is not None else None))
+
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO articles (hash, body) VALUES (?, ?)", articles.items())
+            conn.executemany(
+                "INSERT OR IGNORE INTO runs (run_id, topic, started_at, threshold, max_refinements) "
+                "VALUES (?, ?, ?, ?, ?)", runs)
+            conn.executemany(
+                "INSERT OR IGNORE INTO events (run_id, seq, stage, ts, elapsed_ms, attempt, score, article_hash, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", events)
+            conn.executemany(
+                "INSERT OR IGNORE INTO run_results (run_id, finished_at, status, final_score, attempts, refinements, "
+                "duration_ms, final_article_hash, token_usage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", finishes)
+
+    # -------------------------
+    # Read path
+    # -------------------------
+    def list_runs(self, topic: Optional[str] = None, min_score: Optional[float] = None,
+                  max_score: Optional[float] = None, since: Optional[str] = None,
+                  until: Optional[str] = None, status: Optional[str] = None,
+                  limit: int = 100, offset: int = 0) -> list:
+        """
+        List runs, newest first. topic is a case-insensitive substring match;
+        since / until are ISO dates or datetimes compared against started_at (UTC);
+        a ValueError is raised if they cannot be parsed. Unfinished runs have status 'running'.
+        """
+        clauses, params = [], []
+        if since:
+            since = parse_date(since)
+        if until:
+            until = parse_date(until, end_of_day=True)
+        if topic:
+            clauses.append("topic LIKE ?")
+            params.append(f"%{topic}%")
+        if min_score is not None:
+            clauses.append("res.final_score >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            clauses.append("res.final_score <= ?")
+            params.append(max_score)
+        if since:
+            clauses.append("started_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("started_at <= ?")
+            params.append(until)
+        if status:
+            clauses.append("COALESCE(res.status, 'running') = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"{RUN_SELECT} {where} ORDER BY started_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        finally:
+            conn.close()
+        return [self._run_row(row) for row in rows]
+
+    def get_run(self, run_id: str, include_articles: bool = False) -> Optional[dict]:
+        """
+        Fetch one run with its events in order.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(f"{RUN_SELECT} WHERE runs.run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            run = self._run_row(row)
+            events = conn.execute(
+                "SELECT seq, stage, ts, elapsed_ms, attempt, score, article_hash, data "
+                "FROM events WHERE run_id = ? ORDER BY seq", (run_id,)).fetchall()
+            run['events'] = [
+                {**dict(event), 'data': json.loads(event['data']) if event['data'] else None}
+                for event in events
+            ]
+            if include_articles:
+                hashes = {e['article_hash'] for e in run['events'] if e['article_hash']}
+                if run['final_article_hash']:
+                    hashes.add(run['final_article_hash'])
+                run['articles'] = {
+                    r['hash']: r['body'] for r in conn.execute(
+                        f"SELECT hash, body FROM articles WHERE hash IN ({','.join('?' * len(hashes))})",
+                        list(hashes))
+                } if hashes else {}
+        finally:
+            conn.close()
+        return run
+
+    @staticmethod
+    def _run_row(row: sqlite3.Row) -> dict:
+        run = dict(row)
+        run['token_usage'] = json.loads(run['token_usage']) if run['token_usage'] else None
+        return run
+
+    def export(self, out, fmt: str = "jsonl", **filters) -> int:
+        """
+        Write matching runs to a file object; returns the number of runs written.
+        jsonl includes events and article bodies, csv has one row per run.
+        """
+        runs = self.list_runs(limit=-1, **filters)
+        if fmt == "csv":
+            fields = [k for k in (runs[0].keys() if runs else []) if k != 'token_usage']
+            writer = csv.DictWriter(out, fieldnames=fields + ['total_tokens'], extrasaction="ignore")
+            writer.writeheader()
+            for run in runs:
+                usage = run['token_usage'] or {}
+                writer.writerow({**run, 'total_tokens': usage.get('actual')})
+        elif fmt == "jsonl":
+            for run in runs:
+                out.write(json.dumps(self.get_run(run['run_id'], include_articles=True)) + "\n")
+        else:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        return len(runs)
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history() -> RunHistory:
+    """
+    Process-wide run history store, created on first use.
+    """
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = RunHistory(RUN_HISTORY_DB)
+            atexit.register(_history.close)
+    return _history
+
+
+# -------------------------
+# CLI
+# -------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query and export the article run history")
+    parser.add_argument("--db", default=RUN_HISTORY_DB, help="Path to the run history database")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("list", "export"):
+        cmd = sub.add_parser(name)
+        cmd.add_argument("--topic")
+        cmd.add_argument("--min-score", type=float)
+        cmd.add_argument("--max-score", type=float)
+        cmd.add_argument("--since", help="ISO date, e.g. 2026-01-31")
+        cmd.add_argument("--until", help="ISO date, e.g. 2026-02-28")
+        cmd.add_argument("--status")
+        if name == "list":
+            cmd.add_argument("--limit", type=int, default=20)
+        else:
+            cmd.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+            cmd.add_argument("--out", help="Output file (defaults to stdout)")
+
+    args = parser.parse_args(argv)
+    for name in ("since", "until"):
+        value = getattr(args, name)
+        try:
+            if value:
+                parse_date(value)
+        except ValueError:
+            parser.error(f"--{name}: invalid ISO date '{value}' (expected e.g. 2026-01-31)")
+    history = RunHistory(args.db)
+    filters = dict(topic=args.topic, min_score=args.min_score, max_score=args.max_score,
+                   since=args.since, until=args.until, status=args.status)
+    try:
+        if args.command == "list":
+            for run in history.list_runs(limit=args.limit, **filters):
+                print(f"{run['started_at']}  {run['run_id']}  {run['status']:<16} "
+                      f"score={run['final_score']}  attempts={run['attempts']}  {run['topic']}")
+        else:
+            if args.out:
+                with open(args.out, "w", newline="", encoding="utf-8") as out:
+                    count = history.export(out, args.format, **filters)
+                print(f"Exported {count} runs to {args.out}", file=sys.stderr)
+            else:
+                history.export(sys.stdout, args.format, **filters)
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
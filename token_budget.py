@@ -0,0 +1,169 @@
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character heuristic when tiktoken is missing
+    tiktoken = None
+
+from prompts import Article_scorer_Prompt, Article_changes_proposer_prompt, Refined_Article_Prompt, with_length_limit, model
+
+
+# -------------------------
+# Defaults
+# -------------------------
+DEFAULT_JOB_TOKEN_BUDGET = 60000      # total tokens (prompt + completion) per job
+DEFAULT_COMPLETION_ESTIMATE = 1500    # projected completion size when no cap is given
+REASONING_COMPLETION_ESTIMATE = 4000  # uncapped reasoning-model calls also spend reasoning tokens
+RESPONSE_FORMAT_OVERHEAD_TOKENS = 50  # structured-output schema sent alongside every call
+FEEDBACK_TOKEN_LIMIT = 600            # max tokens kept from justification / weaknesses
+MESSAGE_OVERHEAD_TOKENS = 4           # per-message framing tokens in chat requests
+REPLY_PRIMING_TOKENS = 3              # tokens the API adds to prime every reply
+TRUNCATION_MARKER = " ...[truncated]"
+
+_encodings = {}
+
+
+class CompletionTruncated(Exception):
+    """Raised when a capped completion hits max_completion_tokens before finishing."""
+
+    def __init__(self, stage: str, max_tokens: int):
+        self.stage = stage
+        self.max_tokens = max_tokens
+        super().__init__(
+            f"'{stage}' output was cut off at the {max_tokens}-token completion limit"
+        )
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised when a call would push a job over its token budget."""
+
+    def __init__(self, stage: str, projected: int, remaining: int):
+        self.stage = stage
+        self.projected = projected
+        self.remaining = remaining
+        super().__init__(
+            f"Token budget exhausted before '{stage}': "
+            f"needs ~{projected} tokens, {remaining} remaining"
+        )
+
+
+def _get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Newer models are not always registered in tiktoken yet
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count the tokens of a piece of text locally.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    """
+    Count the prompt tokens of a chat request.
+    """
+    total = REPLY_PRIMING_TOKENS
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS + count_tokens(message["content"], model)
+    return total + RESPONSE_FORMAT_OVERHEAD_TOKENS
+
+
+def completion_estimate(model_name: str, max_tokens: Optional[int] = None) -> int:
+    """
+    Projected completion size of a call, including reasoning tokens when uncapped.
+    """
+    if max_tokens:
+        return max_tokens
+    return REASONING_COMPLETION_ESTIMATE if model_name == model else DEFAULT_COMPLETION_ESTIMATE
+
+
+def _projected_call(system_prompt: str, user_tokens: int, model_name: str, max_tokens: Optional[int] = None) -> int:
+    prompt = count_message_tokens([{"role": "system", "content": system_prompt}], model_name)
+    return prompt + MESSAGE_OVERHEAD_TOKENS + user_tokens + completion_estimate(model_name, max_tokens)
+
+
+def trim_text(text: str, max_tokens: int, model: str) -> str:
+    """
+    Trim text to at most max_tokens tokens, keeping the beginning.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[: max_tokens * 4] + TRUNCATION_MARKER
+    return encoding.decode(encoding.encode(text)[:max_tokens]) + TRUNCATION_MARKER
+
+
+class TokenBudget:
+    """
+    Per-job token accounting shared by all agent calls of one article run.
+    """
+
+    def __init__(self, total: Optional[int] = DEFAULT_JOB_TOKEN_BUDGET):
+        self.total = total
+        self.projected = 0
+        self.actual = 0
+        self.calls = []
+
+    @property
+    def remaining(self) -> Optional[int]:
+        if self.total is None:
+            return None
+        return max(self.total - self.actual, 0)
+
+    def can_afford(self, tokens: int) -> bool:
+        return self.total is None or tokens <= self.remaining
+
+    def reserve(self, stage: str, projected: int):
+        """
+        Check a call against the remaining budget before it is sent.
+        """
+        if not self.can_afford(projected):
+            raise TokenBudgetExceeded(stage, projected, self.remaining)
+
+    def record(self, stage: str, projected: int, prompt_tokens: int, completion_tokens: int):
+        """
+        Record projected and actual usage of a completed call.
+        """
+        actual = prompt_tokens + completion_tokens
+        self.projected += projected
+        self.actual += actual
+        self.calls.append({
+            'stage': stage,
+            'projected': projected,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'actual': actual,
+        })
+
+    def estimate_iteration(self, article_tokens: int, max_tokens: Optional[int]) -> int:
+        """
+        Project the cost of one more propose -> refine -> grade round.
+        """
+        refined_tokens = max_tokens or DEFAULT_COMPLETION_ESTIMATE
+        feedback = 2 * FEEDBACK_TOKEN_LIMIT + 20
+        proposer = _projected_call(Article_changes_proposer_prompt, article_tokens + feedback, model)
+        refiner = _projected_call(with_length_limit(Refined_Article_Prompt, max_tokens),
+                                  article_tokens + DEFAULT_COMPLETION_ESTIMATE, "gpt-4.1", max_tokens)
+        grader = _projected_call(Article_scorer_Prompt, refined_tokens, model)
+        return proposer + refiner + grader
+
+    def report(self) -> dict:
+        return {
+            'budget': self.total,
+            'projected': self.projected,
+            'actual': self.actual,
+            'remaining': self.remaining,
+            'calls': list(self.calls),
+        }